@@ -16,6 +16,7 @@ dotenv.load_dotenv()
 
 from openai_lm import OpenAIChatCompletionProcessor
 from openai_visual import OpenAIVisualCompletionProcessor
+from retry_scheduler import RetryScheduler
 
 
 # message routing file, used for both ingress and egress message handling
@@ -49,6 +50,12 @@ state_router_route = router.find_route('processor/state/router')
 state_stream_route = router.find_route("processor/state")
 usage_route = router.find_route("processor/usage")
 
+# optional, the retry scheduler logs a warning on startup if the route is not configured
+try:
+    dead_letter_route = router.find_route("processor/dead_letter")
+except LookupError:
+    dead_letter_route = None
+
 state_propagation_provider = StatePropagationProviderDistributor(
     propagators=[
         StatePropagationProviderRouterStateSyncStore(route=state_sync_route),
@@ -56,6 +63,12 @@ state_propagation_provider = StatePropagationProviderDistributor(
     ]
 )
 
+# transient openai errors are parked and retried with backoff, without blocking the consumer
+retry_scheduler = RetryScheduler(
+    monitor_route=monitor_route,
+    dead_letter_route=dead_letter_route
+)
+
 
 logging = ism_logger(__name__)
 
@@ -86,6 +99,9 @@ class MessagingConsumerOpenAI(BaseMessageConsumerProcessor):
                 stream_route=state_stream_route,
                 usage_route=usage_route,
                 state_propagation_provider=state_propagation_provider,
+
+                # retry handling for transient openai errors
+                retry_scheduler=retry_scheduler,
             )
 
         elif provider.class_name == "ImageProcessing":
@@ -113,4 +129,10 @@ if __name__ == '__main__':
     )
 
     consumer.setup_shutdown_signal()
-    asyncio.get_event_loop().run_until_complete(consumer.start_consumer())
+
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(consumer.start_consumer())
+    finally:
+        # parked retries only live in memory, dead letter them rather than losing them
+        loop.run_until_complete(retry_scheduler.shutdown())
@@ -4,11 +4,19 @@ from typing import Any, List
 import openai
 import dotenv
 import tiktoken
+from ismcore.model.base_model import ProcessorStatusCode
 from ismcore.processor.base_processor_lm import BaseProcessorLM
 from ismcore.processor.monitored_processor_state import MonitoredUsage
-from ismcore.utils.general_utils import parse_response
+from ismcore.utils.general_utils import parse_response, build_template_text_v2
 from ismcore.utils.ism_logger import ism_logger
-from openai import OpenAI
+from openai import AsyncOpenAI
+
+from retry_scheduler import (
+    RetryableProcessorMixin,
+    RetryableEntryError,
+    RetryScheduler,
+    StreamInterruptedError,
+    is_retryable_error)
 
 dotenv.load_dotenv()
 
@@ -20,10 +28,11 @@ logging.info(f'**** OPENAI API KEY (last 4 chars): {openai_api_key[-4:]} ****')
 
 
 
-class OpenAIChatCompletionProcessor(BaseProcessorLM, MonitoredUsage):
+class OpenAIChatCompletionProcessor(RetryableProcessorMixin, BaseProcessorLM, MonitoredUsage):
 
-    def __init__(self, **kwargs):
+    def __init__(self, retry_scheduler: RetryScheduler = None, **kwargs):
         super().__init__(**kwargs)
+        self.retry_scheduler = retry_scheduler
         MonitoredUsage.__init__(self, **kwargs)
 
     # async def process_input_data_entry(self, input_query_state: dict, force: bool = False):
@@ -57,6 +66,114 @@ class OpenAIChatCompletionProcessor(BaseProcessorLM, MonitoredUsage):
 
         return total_tokens
 
+    async def process_input_data_stream(self, input_data: dict | List[dict], force: bool = False):
+        if not self.retry_scheduler:
+            return await super().process_input_data_stream(input_data=input_data, force=force)
+
+        # same as the base implementation, except that a retryable error raised before any content is streamed
+        # parks the stream with the retry scheduler, instead of publishing an error marker to the subscribers
+        if not self.stream_route:
+            raise ValueError(
+                f"streams are not supported by provider: {self.output_processor_state.id}, "
+                f"route_id {self.output_processor_state.id}")
+
+        if not input_data:
+            raise ValueError("invalid input state, cannot be empty")
+
+        template = build_template_text_v2(self.template, input_data)
+
+        if 'session_id' in input_data:
+            session_id = input_data["session_id"]
+            subject = f"processor.state.{self.output_state.id}.{session_id}"
+        else:
+            subject = f"processor.state.{self.output_state.id}"
+
+        name = f"{subject}".replace("-", "_")
+
+        # submit to the fully qualified subject, which may include a session id
+        stream_route = self.stream_route.clone(
+            route_config_updates={
+                "subject": subject,
+                "name": name
+            }
+        )
+
+        try:
+            # submit the original request to the stream, such that it is broadcast to all subscribers of the subject
+            if 'source' in input_data:
+                await stream_route.publish(input_data['source'])
+                await stream_route.publish("<<>>SOURCE<<>>")
+
+            if 'input' in input_data:
+                await stream_route.publish(input_data['input'])
+                await stream_route.publish("<<>>INPUT<<>>")
+
+            await stream_route.flush()
+            await self._publish_stream(stream_route=stream_route, input_data=input_data, template=template)
+        except Exception as exception:
+            # the headers are already out, a retry only replays the model response
+            if is_retryable_error(exception):
+                async def retry():
+                    await self._retry_stream(stream_route=stream_route, input_data=input_data, template=template)
+
+                async def on_dead_letter(error: Exception):
+                    await self._fail_stream(stream_route=stream_route, input_data=input_data, exception=error)
+
+                raise RetryableEntryError(
+                    error=exception,
+                    data=input_data,
+                    retry=retry,
+                    on_dead_letter=on_dead_letter) from exception
+
+            # partial output was already streamed, keep the error context on the dead letter route
+            if isinstance(exception, StreamInterruptedError):
+                await self.retry_scheduler.dead_letter(
+                    error=exception,
+                    context=self._retry_context(input_data),
+                    reason="stream_interrupted")
+
+            await self._fail_stream(stream_route=stream_route, input_data=input_data, exception=exception)
+
+    async def _publish_stream(self, stream_route, input_data: Any, template: str):
+        logging.debug(f"entered streaming mode, state_id: {self.output_state.id}")
+
+        # execute and iterate the yielded data directly into the upstream route
+        async for content in self._stream(input_data=input_data, template=template):
+            try:
+                if isinstance(content, str):
+                    await stream_route.publish(content)
+                    await stream_route.flush()
+                elif content is None:
+                    logging.warning('Received NoneType content, skipping...')
+                else:
+                    logging.warning(f'Unexpected content type: {type(content)}')
+            except Exception as critical:
+                logging.critical(f'Exception encountered during streaming: {critical}', exc_info=True)
+
+        # submit the response message to the stream.
+        await stream_route.publish("<<>>ASSISTANT<<>>")
+        await stream_route.flush()
+
+        # should gracefully close the connection
+        await stream_route.disconnect()
+
+        logging.debug(f"exit streaming mode, state_id: {self.output_state.id}")
+
+    async def _retry_stream(self, stream_route, input_data: Any, template: str):
+        if not await self.can_processor_process_data():
+            raise ValueError(f'processor {self.processor.id} is in a stopped state, cannot retry stream')
+
+        route_id = self.output_processor_state.id
+        await self.send_processor_state_update(route_id=route_id, status=ProcessorStatusCode.RUNNING)
+        await self._publish_stream(stream_route=stream_route, input_data=input_data, template=template)
+        await self.send_processor_state_update(route_id=route_id, status=ProcessorStatusCode.COMPLETED)
+
+    async def _fail_stream(self, stream_route, input_data: Any, exception: Exception):
+        # submit the error marker to the stream, and report the failure to the monitor
+        await stream_route.publish("<<>>ERROR<<>>")
+        await stream_route.flush()
+        await self._fail_entry(route_id=self.output_processor_state.id, exception=exception, data=input_data)
+
     async def _stream(self, input_data: Any, template: str):
         if not template:
             template = str(input_data)
@@ -70,10 +187,12 @@ class OpenAIChatCompletionProcessor(BaseProcessorLM, MonitoredUsage):
         # input_tokens = sum([len(tiktoken.encode(message['content'])) for message in message_list])
         encoding = tiktoken.encoding_for_model(self.provider.version)
 
-        client = OpenAI()
+        # async client, such that the request does not block the event loop while it waits on the response,
+        # sdk retries are disabled as transient errors are retried by the retry scheduler
+        client = AsyncOpenAI(max_retries=0)
 
         # Create a streaming completion
-        stream = client.chat.completions.create(
+        stream = await client.chat.completions.create(
             model=self.provider.version,
             messages=message_list,
             max_tokens=4096,
@@ -86,12 +205,19 @@ class OpenAIChatCompletionProcessor(BaseProcessorLM, MonitoredUsage):
         # Iterate over the streamed responses and yield the content
         output_data = []
         output_token_count = 0
-        for chunk in stream:
-            content = chunk.choices[0].delta.content
-            if content:
-                output_data.append(content)
-                output_token_count += self.num_tokens_from_string(text=content, encoding=encoding)
-                yield content
+        try:
+            async for chunk in stream:
+                content = chunk.choices[0].delta.content
+                if content:
+                    output_data.append(content)
+                    output_token_count += self.num_tokens_from_string(text=content, encoding=encoding)
+                    yield content
+        except Exception as exception:
+            # once content has been yielded the stream cannot be retried without duplicating output
+            if output_data:
+                raise StreamInterruptedError(
+                    f'stream interrupted after {len(output_data)} chunks, error: {exception}') from exception
+            raise
 
         # count the number of tokens on output text
 
@@ -124,9 +250,9 @@ class OpenAIChatCompletionProcessor(BaseProcessorLM, MonitoredUsage):
         if not messages_dict:
             raise Exception(f'no prompts specified for values {values}')
 
-        client = OpenAI()
+        client = AsyncOpenAI(max_retries=0)
 
-        stream = client.chat.completions.create(
+        stream = await client.chat.completions.create(
             model=self.provider.version,
             messages=messages_dict,
             stream=False,
@@ -0,0 +1,254 @@
+import asyncio
+import json
+import os
+from types import SimpleNamespace
+
+import httpx
+import openai
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+
+from ismcore.model.base_model import Processor, ProcessorProvider, ProcessorState
+from ismcore.model.processor_state import State, StateConfigLM, StateConfigStream
+from ismcore.utils.general_utils import parse_response
+
+from openai_lm import OpenAIChatCompletionProcessor
+from retry_scheduler import RetryScheduler, StreamInterruptedError
+
+request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def status_error(status_code: int) -> openai.APIStatusError:
+    return openai.APIStatusError("error", response=httpx.Response(status_code, request=request), body=None)
+
+
+class MockRoute:
+    def __init__(self):
+        self.messages = []
+
+    async def publish(self, msg: str):
+        self.messages.append(msg)
+
+    async def flush(self):
+        pass
+
+    async def disconnect(self):
+        pass
+
+    def clone(self, route_config_updates: dict):
+        return self
+
+    def json_messages(self, message_type: str = None):
+        messages = [json.loads(message) for message in self.messages]
+        return [message for message in messages if not message_type or message.get("type") == message_type]
+
+    def statuses(self):
+        return [message["status"] for message in self.json_messages("processor_state")]
+
+
+class MockStorage:
+    def fetch_processor(self, processor_id: str):
+        return Processor(id=processor_id, project_id="test-project")
+
+    def fetch_user_project(self, project_id: str):
+        return SimpleNamespace(user_id="test-user")
+
+    def fetch_user_profile(self, user_id: str):
+        return SimpleNamespace(user_id=user_id, max_agentic_units=100)
+
+    def fetch_usage_report(self, **kwargs):
+        return []
+
+    def fetch_template(self, template_id: str):
+        return None
+
+
+class MockProcessor(OpenAIChatCompletionProcessor):
+    """Fails the first `failures` calls to the model with `error`, then succeeds."""
+
+    def __init__(self, error: Exception, failures: int, **kwargs):
+        super().__init__(**kwargs)
+        self.error = error
+        self.failures = failures
+        self.calls = 0
+
+    async def _execute(self, user_prompt: str, system_prompt: str, values: dict):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+
+        return parse_response(raw_response="hello")
+
+    async def _stream(self, input_data, template: str):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+
+        yield "hello"
+        yield " world"
+
+
+def create_processor(config, error: Exception, failures: int):
+    monitor_route = MockRoute()
+    dead_letter_route = MockRoute()
+    stream_route = MockRoute()
+
+    scheduler = RetryScheduler(
+        monitor_route=monitor_route,
+        dead_letter_route=dead_letter_route,
+        max_attempts=3,
+        base_delay=0.001,
+        max_delay=0.01)
+
+    processor = MockProcessor(
+        error=error,
+        failures=failures,
+        state_machine_storage=MockStorage(),
+        output_state=State(id="test-output-state", config=config),
+        provider=ProcessorProvider(id="test-provider", name="OpenAI", version="gpt-4o", class_name="NaturalLanguageProcessing"),
+        processor=Processor(id="test-processor", project_id="test-project"),
+        output_processor_state=ProcessorState(id="test-route", processor_id="test-processor", state_id="test-output-state"),
+        monitor_route=monitor_route,
+        stream_route=stream_route,
+        retry_scheduler=scheduler)
+
+    return processor, scheduler, monitor_route, dead_letter_route, stream_route
+
+
+async def wait_until(condition, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "condition not met before timeout"
+        await asyncio.sleep(0.005)
+
+
+def test_execute_entry_parks_and_dead_letters():
+    async def run():
+        processor, scheduler, monitor_route, dead_letter_route, _ = create_processor(
+            config=StateConfigLM(name="test", user_template_id="test-template"),
+            error=status_error(429),
+            failures=10)
+
+        # the entry is parked, neither failed nor completed
+        await processor.execute_entry(input_query_state={"query": "hello"})
+        assert scheduler.scheduled_count == 1
+        assert monitor_route.statuses() == ["RUNNING", "QUEUED"]
+
+        await wait_until(lambda: scheduler.dead_letter_count == 1)
+
+        # the initial attempt plus each retry through execute_entry
+        assert processor.calls == 4
+        assert scheduler.retried_count == 3
+        assert dead_letter_route.json_messages() == [{
+            "processor_id": "test-processor",
+            "output_state_id": "test-output-state",
+            "input_query_state": {"query": "hello"},
+            "reason": "exhausted",
+            "attempts": 3,
+            "error_type": "APIStatusError",
+            "error_message": "error",
+            "retryable": True,
+        }]
+
+        statuses = monitor_route.statuses()
+        assert statuses[-1] == "FAILED"
+        assert "COMPLETED" not in statuses
+        assert monitor_route.json_messages("processor_retry_stats")[-1]["dead_letter"] == 1
+
+    asyncio.run(run())
+
+
+def test_execute_entry_retry_recovers():
+    async def run():
+        processor, scheduler, monitor_route, dead_letter_route, _ = create_processor(
+            config=StateConfigLM(name="test", user_template_id="test-template"),
+            error=status_error(503),
+            failures=1)
+
+        await processor.execute_entry(input_query_state={"query": "hello"})
+        await wait_until(lambda: scheduler.recovered_count == 1)
+
+        assert processor.calls == 2
+        assert not dead_letter_route.messages
+        assert monitor_route.statuses() == ["RUNNING", "QUEUED", "RUNNING", "COMPLETED"]
+
+    asyncio.run(run())
+
+
+def test_execute_entry_fatal_error_fails():
+    async def run():
+        processor, scheduler, monitor_route, dead_letter_route, _ = create_processor(
+            config=StateConfigLM(name="test", user_template_id="test-template"),
+            error=status_error(400),
+            failures=1)
+
+        await processor.execute_entry(input_query_state={"query": "hello"})
+
+        assert processor.calls == 1
+        assert scheduler.scheduled_count == 0
+        assert "FAILED" in monitor_route.statuses()
+        assert not dead_letter_route.messages
+
+    asyncio.run(run())
+
+
+def test_stream_retry_publishes_once():
+    async def run():
+        processor, scheduler, monitor_route, dead_letter_route, stream_route = create_processor(
+            config=StateConfigStream(name="test"),
+            error=status_error(429),
+            failures=1)
+
+        await processor.execute_entry(input_query_state={"source": "user", "input": "hi"})
+        assert monitor_route.statuses() == ["RUNNING", "QUEUED"]
+
+        await wait_until(lambda: scheduler.recovered_count == 1)
+
+        # the headers are not replayed, and no error marker reaches the subscribers
+        assert stream_route.messages == [
+            "user", "<<>>SOURCE<<>>", "hi", "<<>>INPUT<<>>", "hello", " world", "<<>>ASSISTANT<<>>"
+        ]
+        assert monitor_route.statuses() == ["RUNNING", "QUEUED", "RUNNING", "COMPLETED"]
+        assert not dead_letter_route.messages
+
+    asyncio.run(run())
+
+
+def test_stream_retries_exhausted_dead_letters():
+    async def run():
+        processor, scheduler, monitor_route, dead_letter_route, stream_route = create_processor(
+            config=StateConfigStream(name="test"),
+            error=status_error(429),
+            failures=10)
+
+        await processor.execute_entry(input_query_state={"source": "user", "input": "hi"})
+        await wait_until(lambda: scheduler.dead_letter_count == 1)
+
+        assert processor.calls == 4
+        assert stream_route.messages == ["user", "<<>>SOURCE<<>>", "hi", "<<>>INPUT<<>>", "<<>>ERROR<<>>"]
+        assert dead_letter_route.json_messages()[0]["input_query_state"] == {"source": "user", "input": "hi"}
+        assert monitor_route.statuses()[-1] == "FAILED"
+
+    asyncio.run(run())
+
+
+def test_stream_interrupted_is_not_retried():
+    async def run():
+        processor, scheduler, monitor_route, dead_letter_route, stream_route = create_processor(
+            config=StateConfigStream(name="test"),
+            error=status_error(503),
+            failures=0)
+
+        async def interrupted_stream(input_data, template: str):
+            yield "hello"
+            raise StreamInterruptedError("interrupted") from status_error(503)
+
+        processor._stream = interrupted_stream
+        await processor.execute_entry(input_query_state={"source": "user", "input": "hi"})
+
+        assert scheduler.scheduled_count == 0
+        assert stream_route.messages[-2:] == ["hello", "<<>>ERROR<<>>"]
+        assert dead_letter_route.json_messages()[0]["reason"] == "stream_interrupted"
+        assert "FAILED" in monitor_route.statuses()
+
+    asyncio.run(run())
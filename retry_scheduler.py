@@ -0,0 +1,389 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+import dotenv
+import openai
+from ismcore.model.base_model import ProcessorStatusCode
+from ismcore.utils.ism_logger import ism_logger
+
+dotenv.load_dotenv()
+
+# retry related, exponential backoff with full jitter between attempts
+RETRY_MAX_ATTEMPTS = int(os.environ.get("RETRY_MAX_ATTEMPTS", 5))
+RETRY_BASE_DELAY = float(os.environ.get("RETRY_BASE_DELAY", 1.0))
+RETRY_MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", 60.0))
+
+# bounds on the retry backlog, such that an outage does not turn into a retry storm
+RETRY_MAX_PENDING = int(os.environ.get("RETRY_MAX_PENDING", 1000))
+RETRY_MAX_CONCURRENCY = int(os.environ.get("RETRY_MAX_CONCURRENCY", 4))
+
+# http status codes below 500 returned by the openai api that are worth retrying
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+logging = ism_logger(__name__)
+
+# set while a parked entry is being retried, such that its failures reach the scheduler instead of the monitor
+_retrying = contextvars.ContextVar("retrying", default=False)
+
+
+class StreamInterruptedError(Exception):
+    """Raised when a stream fails after output was already sent, a retry would duplicate that output."""
+
+
+class RetryableEntryError(Exception):
+    """Raised out of the processing methods to hand an entry that failed with a retryable error to the scheduler."""
+
+    def __init__(self,
+                 error: Exception,
+                 data: Any,
+                 retry: Optional[Callable[[], Awaitable[Any]]] = None,
+                 on_dead_letter: Optional[Callable[[Exception], Awaitable[Any]]] = None):
+
+        super().__init__(str(error))
+        self.error = error
+        self.data = data
+        self.retry = retry
+        self.on_dead_letter = on_dead_letter
+
+
+def is_retryable_error(exception: Exception) -> bool:
+    """Classify an error as retryable (transient) or fatal."""
+
+    # partial output was already sent, the entry cannot be replayed
+    if isinstance(exception, StreamInterruptedError):
+        return False
+
+    if isinstance(exception, RetryableEntryError):
+        return True
+
+    # connection issues and timeouts (APITimeoutError is a subclass of APIConnectionError)
+    if isinstance(exception, openai.APIConnectionError):
+        return True
+
+    # rate limits, overloaded or failing upstream servers
+    if isinstance(exception, openai.APIStatusError):
+        return exception.status_code in RETRYABLE_STATUS_CODES or exception.status_code >= 500
+
+    # local transport errors raised outside of the openai client
+    if isinstance(exception, (asyncio.TimeoutError, ConnectionError)):
+        return True
+
+    # anything else (bad request, authentication, invalid template, etc.) is fatal
+    return False
+
+
+class RetryEntry:
+
+    def __init__(self,
+                 retry: Callable[[], Awaitable[Any]],
+                 error: Exception,
+                 context: dict,
+                 attempts: int = 0,
+                 on_dead_letter: Optional[Callable[[Exception], Awaitable[Any]]] = None):
+
+        self.retry = retry
+        self.error = error
+        self.context = context
+        self.attempts = attempts
+        self.on_dead_letter = on_dead_letter
+
+
+class RetryScheduler:
+    """
+    Parks retryable entries in a delayed queue such that the consumer can continue
+    processing other messages while the entry waits out its backoff period. Entries
+    that exhaust their retries are sent to the dead letter route along with their
+    error context; retry and dead letter counts are published on the monitor route.
+    """
+
+    def __init__(self,
+                 monitor_route: Optional[Any] = None,
+                 dead_letter_route: Optional[Any] = None,
+                 max_attempts: int = RETRY_MAX_ATTEMPTS,
+                 base_delay: float = RETRY_BASE_DELAY,
+                 max_delay: float = RETRY_MAX_DELAY,
+                 max_pending: int = RETRY_MAX_PENDING,
+                 max_concurrency: int = RETRY_MAX_CONCURRENCY):
+
+        self.monitor_route = monitor_route
+        self.dead_letter_route = dead_letter_route
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+
+        if not self.dead_letter_route:
+            logging.warning('no dead letter route configured (processor/dead_letter), '
+                            'entries that exhaust their retries will be dropped')
+
+        # delayed queue ordered by due time, the sequence breaks ties between equal due times
+        self._queue = []
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self._closed = False
+
+        # entries currently being retried, and the tasks retrying them
+        self._in_flight = set()
+        self._tasks = set()
+        self._concurrency = asyncio.Semaphore(max_concurrency)
+
+        # telemetry counters
+        self.scheduled_count = 0
+        self.retried_count = 0
+        self.recovered_count = 0
+        self.dead_letter_count = 0
+
+    def backoff_delay(self, attempt: int) -> float:
+        # full jitter, spreads out retries from entries that failed at the same time
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._queue) + len(self._in_flight)
+
+    async def schedule(self,
+                       retry: Callable[[], Awaitable[Any]],
+                       error: Exception,
+                       context: dict,
+                       on_dead_letter: Optional[Callable[[Exception], Awaitable[Any]]] = None):
+        """
+        Park an entry that failed with a retryable error, the caller does not wait on the retry.
+        The on_dead_letter callback is invoked with the last error if the entry is dead lettered.
+        """
+        await self._park(RetryEntry(retry=retry, error=error, context=context, on_dead_letter=on_dead_letter))
+
+    async def dead_letter(self,
+                          error: Exception,
+                          context: dict,
+                          reason: str,
+                          on_dead_letter: Optional[Callable[[Exception], Awaitable[Any]]] = None):
+        """Send an entry straight to the dead letter route, without retrying it."""
+        entry = RetryEntry(retry=None, error=error, context=context, on_dead_letter=on_dead_letter)
+        await self._dead_letter(entry, reason=reason)
+
+    async def shutdown(self):
+        """Stop retrying and dead letter every entry that is still parked or in flight."""
+        self._closed = True
+
+        if self._worker:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+
+        # entries interrupted mid retry stay in flight and are dead lettered below
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        entries = [entry for _, _, entry in self._queue] + list(self._in_flight)
+        self._queue.clear()
+        self._in_flight.clear()
+
+        if entries:
+            logging.warning(f'shutting down retry scheduler with {len(entries)} pending entries')
+
+        for entry in entries:
+            await self._dead_letter(entry, reason="shutdown", error_type="shutdown")
+
+    async def _park(self, entry: RetryEntry):
+        if self._closed:
+            await self._dead_letter(entry, reason="shutdown", error_type="shutdown")
+            return
+
+        if entry.attempts >= self.max_attempts:
+            await self._dead_letter(entry, reason="exhausted")
+            return
+
+        if self.pending_count >= self.max_pending:
+            await self._dead_letter(entry, reason="queue_full")
+            return
+
+        delay = self.backoff_delay(entry.attempts + 1)
+        heapq.heappush(self._queue, (time.monotonic() + delay, next(self._sequence), entry))
+        self.scheduled_count += 1
+
+        logging.warning(f'scheduled retry attempt {entry.attempts + 1}/{self.max_attempts} in {delay:.2f}s '
+                        f'for {entry.context}, error: {entry.error}')
+
+        self._ensure_worker()
+        self._wakeup.set()
+        await self.send_retry_stats()
+
+    def _ensure_worker(self):
+        if self._worker and not self._worker.done():
+            return
+
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+
+            # wait until the next entry is due, or until a new entry is parked
+            timeout = None
+            if self._queue:
+                timeout = max(0.0, self._queue[0][0] - time.monotonic())
+
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+            # release the entries that are due, bounded by the number of concurrent retries
+            while self._queue and self._queue[0][0] <= time.monotonic():
+                await self._concurrency.acquire()
+                if not self._queue:
+                    self._concurrency.release()
+                    break
+
+                _, _, entry = heapq.heappop(self._queue)
+                self._in_flight.add(entry)
+
+                task = asyncio.create_task(self._retry(entry))
+                self._tasks.add(task)
+                task.add_done_callback(self._release)
+
+    def _release(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        self._concurrency.release()
+
+    async def _retry(self, entry: RetryEntry):
+        entry.attempts += 1
+        self.retried_count += 1
+
+        try:
+            await entry.retry()
+        except Exception as exception:
+            self._in_flight.discard(entry)
+            entry.error = exception
+
+            if not is_retryable_error(exception):
+                logging.error(f'retry attempt {entry.attempts} failed with fatal error for {entry.context}, '
+                              f'error: {exception}')
+                await self._dead_letter(entry, reason="fatal")
+                return
+
+            await self._park(entry)
+            return
+
+        self._in_flight.discard(entry)
+        self.recovered_count += 1
+        logging.info(f'retry attempt {entry.attempts} succeeded for {entry.context}')
+        await self.send_retry_stats()
+
+    async def _dead_letter(self, entry: RetryEntry, reason: str, error_type: Optional[str] = None):
+        self.dead_letter_count += 1
+
+        logging.error(f'dead letter entry ({reason}) after {entry.attempts} retry attempts for {entry.context}, '
+                      f'error: {entry.error}')
+
+        if self.dead_letter_route:
+            try:
+                await self.dead_letter_route.publish(json.dumps({
+                    **entry.context,
+                    "reason": reason,
+                    "attempts": entry.attempts,
+                    "error_type": error_type or type(entry.error).__name__,
+                    "error_message": str(entry.error),
+                    "retryable": is_retryable_error(entry.error),
+                }, default=str))
+            except Exception as exception:
+                logging.error(f'unable to publish to dead letter route, error: {exception}')
+
+        if entry.on_dead_letter:
+            try:
+                await entry.on_dead_letter(entry.error)
+            except Exception as exception:
+                logging.error(f'unable to report dead letter entry {entry.context}, error: {exception}')
+
+        await self.send_retry_stats()
+
+    async def send_retry_stats(self):
+        if not self.monitor_route:
+            return
+
+        try:
+            await self.monitor_route.publish(json.dumps({
+                "type": "processor_retry_stats",
+                "scheduled": self.scheduled_count,
+                "retried": self.retried_count,
+                "recovered": self.recovered_count,
+                "dead_letter": self.dead_letter_count,
+                "pending": self.pending_count,
+            }))
+        except Exception as exception:
+            logging.error(f'unable to publish retry stats to monitor route, error: {exception}')
+
+
+class RetryableProcessorMixin:
+    """
+    The base processors report any error raised while processing an entry to fail_execute_processor_state,
+    without re-raising it. Retryable errors are instead raised out of execute_entry / execute_set, such that
+    the entry is parked with the retry scheduler rather than being failed or completed. Parked entries are
+    retried through execute_entry / execute_set, and reported as failed once they are dead lettered.
+    """
+
+    retry_scheduler: Optional[RetryScheduler] = None
+
+    def _retry_context(self, data: Any) -> dict:
+        return {
+            "processor_id": self.processor.id if self.processor else None,
+            "output_state_id": self.output_state.id if self.output_state else None,
+            "input_query_state": data,
+        }
+
+    async def _fail_entry(self, route_id: str, exception: Any, data: Any = None):
+        # report the failure to the monitor, bypassing the retry handling below
+        await super().fail_execute_processor_state(route_id=route_id, exception=exception, data=data)
+
+    async def fail_execute_processor_state(self, route_id: str, exception: Any, data: dict = None, **kwargs):
+        # the entry is being retried, let the scheduler decide whether to retry it again or dead letter it
+        if _retrying.get():
+            raise exception
+
+        if isinstance(exception, RetryableEntryError):
+            await self._park_entry(route_id=route_id, exception=exception)
+            return
+
+        # escape the processing method, such that execute_entry parks the entry instead of completing it
+        if self.retry_scheduler and is_retryable_error(exception):
+            raise RetryableEntryError(error=exception, data=data) from exception
+
+        await super().fail_execute_processor_state(route_id=route_id, exception=exception, data=data, **kwargs)
+
+    async def _park_entry(self, route_id: str, exception: RetryableEntryError):
+        data = exception.data
+
+        async def retry():
+            execute = self.execute_set if isinstance(data, list) else self.execute_entry
+            token = _retrying.set(True)
+            try:
+                await execute(input_query_state=data)
+            finally:
+                _retrying.reset(token)
+
+        async def on_dead_letter(error: Exception):
+            await self._fail_entry(route_id=route_id, exception=error, data=data)
+
+        await self.retry_scheduler.schedule(
+            retry=exception.retry or retry,
+            error=exception.error,
+            context=self._retry_context(data),
+            on_dead_letter=exception.on_dead_letter or on_dead_letter)
+
+        # QUEUED: the entry is waiting on its next retry attempt
+        await self.send_processor_state_update(
+            route_id=route_id,
+            status=ProcessorStatusCode.QUEUED,
+            exception=exception.error,
+            data=data)
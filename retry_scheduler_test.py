@@ -0,0 +1,197 @@
+import asyncio
+import json
+
+import httpx
+import openai
+import pytest
+
+from retry_scheduler import RetryScheduler, StreamInterruptedError, is_retryable_error
+
+request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def status_error(status_code: int) -> openai.APIStatusError:
+    return openai.APIStatusError("error", response=httpx.Response(status_code, request=request), body=None)
+
+
+class MockRoute:
+    def __init__(self):
+        self.messages = []
+
+    async def publish(self, msg: str):
+        self.messages.append(json.loads(msg))
+
+
+def create_scheduler(**kwargs):
+    monitor_route = MockRoute()
+    dead_letter_route = MockRoute()
+    scheduler = RetryScheduler(
+        monitor_route=monitor_route,
+        dead_letter_route=dead_letter_route,
+        **{"max_attempts": 3, "base_delay": 0.001, "max_delay": 0.01, **kwargs})
+    return scheduler, monitor_route, dead_letter_route
+
+
+async def wait_until(condition, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "condition not met before timeout"
+        await asyncio.sleep(0.005)
+
+
+@pytest.mark.parametrize("error, retryable", [
+    (status_error(429), True),
+    (status_error(503), True),
+    (status_error(400), False),
+    (openai.APIConnectionError(request=request), True),
+    (StreamInterruptedError("interrupted"), False),
+    (ValueError("bad template"), False),
+])
+def test_is_retryable_error(error, retryable):
+    assert is_retryable_error(error) == retryable
+
+
+def test_backoff_delay_within_bounds():
+    scheduler, _, _ = create_scheduler(base_delay=0.5, max_delay=10.0)
+    for attempt in range(1, 10):
+        ceiling = min(10.0, 0.5 * 2 ** (attempt - 1))
+        for _ in range(100):
+            assert 0 <= scheduler.backoff_delay(attempt) <= ceiling
+
+
+def test_retry_recovers():
+    async def run():
+        scheduler, monitor_route, dead_letter_route = create_scheduler()
+        calls = []
+
+        async def retry():
+            calls.append(1)
+            if len(calls) < 2:
+                raise status_error(503)
+
+        await scheduler.schedule(retry=retry, error=status_error(429), context={"entry": "a"})
+        await wait_until(lambda: scheduler.recovered_count == 1)
+
+        assert len(calls) == 2
+        assert scheduler.dead_letter_count == 0
+        assert not dead_letter_route.messages
+        assert monitor_route.messages[-1]["type"] == "processor_retry_stats"
+        assert monitor_route.messages[-1]["recovered"] == 1
+        assert monitor_route.messages[-1]["pending"] == 0
+
+    asyncio.run(run())
+
+
+def test_retries_exhausted_dead_letter():
+    async def run():
+        scheduler, monitor_route, dead_letter_route = create_scheduler()
+
+        async def retry():
+            raise status_error(429)
+
+        await scheduler.schedule(retry=retry, error=status_error(429), context={"entry": "a"})
+        await wait_until(lambda: scheduler.dead_letter_count == 1)
+
+        assert scheduler.retried_count == 3
+        assert dead_letter_route.messages == [{
+            "entry": "a",
+            "reason": "exhausted",
+            "attempts": 3,
+            "error_type": "APIStatusError",
+            "error_message": "error",
+            "retryable": True,
+        }]
+        assert monitor_route.messages[-1]["dead_letter"] == 1
+        assert monitor_route.messages[-1]["pending"] == 0
+
+    asyncio.run(run())
+
+
+def test_fatal_error_during_retry_dead_letter():
+    async def run():
+        scheduler, _, dead_letter_route = create_scheduler()
+
+        async def retry():
+            raise status_error(400)
+
+        await scheduler.schedule(retry=retry, error=status_error(503), context={"entry": "a"})
+        await wait_until(lambda: scheduler.dead_letter_count == 1)
+
+        assert scheduler.retried_count == 1
+        assert dead_letter_route.messages[0]["reason"] == "fatal"
+        assert dead_letter_route.messages[0]["attempts"] == 1
+        assert dead_letter_route.messages[0]["retryable"] is False
+
+    asyncio.run(run())
+
+
+def test_max_pending_dead_letter():
+    async def run():
+        scheduler, _, dead_letter_route = create_scheduler(max_pending=2)
+        scheduler.backoff_delay = lambda attempt: 10.0
+
+        async def retry():
+            pass
+
+        for entry in ["a", "b", "c"]:
+            await scheduler.schedule(retry=retry, error=status_error(429), context={"entry": entry})
+
+        assert scheduler.pending_count == 2
+        assert dead_letter_route.messages[0]["entry"] == "c"
+        assert dead_letter_route.messages[0]["reason"] == "queue_full"
+
+        await scheduler.shutdown()
+
+    asyncio.run(run())
+
+
+def test_max_concurrency():
+    async def run():
+        scheduler, _, _ = create_scheduler(max_concurrency=2)
+        running = []
+        peak = []
+
+        async def retry():
+            running.append(1)
+            peak.append(len(running))
+            await asyncio.sleep(0.02)
+            running.pop()
+
+        for entry in range(6):
+            await scheduler.schedule(retry=retry, error=status_error(429), context={"entry": entry})
+
+        await wait_until(lambda: scheduler.recovered_count == 6)
+        assert max(peak) == 2
+
+    asyncio.run(run())
+
+
+def test_shutdown_dead_letters_pending():
+    async def run():
+        scheduler, monitor_route, dead_letter_route = create_scheduler()
+        blocked = asyncio.Event()
+
+        async def retry():
+            await blocked.wait()
+
+        scheduler.backoff_delay = lambda attempt: 10.0
+        await scheduler.schedule(retry=retry, error=status_error(429), context={"entry": "parked"})
+
+        # retry the next entry immediately, such that it is in flight at shutdown
+        scheduler.backoff_delay = lambda attempt: 0.0
+        await scheduler.schedule(retry=retry, error=status_error(429), context={"entry": "in_flight"})
+        await wait_until(lambda: scheduler.retried_count == 1)
+
+        await scheduler.shutdown()
+
+        assert sorted(message["entry"] for message in dead_letter_route.messages) == ["in_flight", "parked"]
+        assert all(message["error_type"] == "shutdown" for message in dead_letter_route.messages)
+        assert scheduler.pending_count == 0
+        assert monitor_route.messages[-1]["dead_letter"] == 2
+
+        # entries arriving after shutdown are not parked
+        await scheduler.schedule(retry=retry, error=status_error(429), context={"entry": "late"})
+        assert dead_letter_route.messages[-1]["entry"] == "late"
+        assert scheduler.pending_count == 0
+
+    asyncio.run(run())